@@ -1,5 +1,10 @@
 #!/usr/bin/env python3
-import sys, string, os
+import sys, string, os, functools, re, mmap, atexit, codecs
+from concurrent.futures import ProcessPoolExecutor
+try:
+    import hyperscan    # optional, see compile_hs
+except ImportError:
+    hyperscan = None
 
 # ------------------------------------------------------------
 # Simple grep-like tool with a tiny custom regex engine.
@@ -9,6 +14,7 @@ import sys, string, os
 #   Any char:           .
 #   Char class:         [abc]      any of a,b,c
 #   Negated class:      [^abc]     any char except a,b,c
+#   Ranges in classes:  [a-z0-9]   any char from a to z or 0 to 9 (by code point)
 #   Shorthand:          \d         digit 0-9
 #                        \w         [0-9A-Za-z_]
 #                        \\         a literal backslash
@@ -18,8 +24,11 @@ import sys, string, os
 #   Anchors:            ^  start of string,  $  end of string
 #   Backrefs:           \1 \2 ...  match exactly what group 1, 2, ... matched
 #
+# Input is UTF-8: '.' and classes match one whole character. Bytes that
+# are not valid UTF-8 are skipped when matching (lines print unchanged).
+#
 # What this does NOT support (on purpose, to stay tiny):
-#   '*'  '{m,n}'  lookaheads  lookbehinds  complex escapes  ranges like [a-z]
+#   '*'  '{m,n}'  lookaheads  lookbehinds  complex escapes
 #
 # Exit code:
 #   0 if at least one match was printed, 1 if none, 1 for bad args.
@@ -34,40 +43,16 @@ import sys, string, os
 DIGITS = string.digits
 WORD   = DIGITS + string.ascii_letters + "_"
 
-# ---------------- regex engine ----------------
-def find_close(p, i=0):
-    """
-    Find the index of the ')' that closes the '(' at or after position i.
-    Skips over [...] character classes and respects escapes like '\]'.
-    Raises ValueError if parentheses are unbalanced.
-
-    Think: walk the pattern once, track:
-      depth   -> how many '(' we've seen and not closed
-      in_class-> are we inside a [...]
-      esc     -> did we just see a backslash (so next char is literal)
-    """
-    depth=0; in_class=False; esc=False
-    while i < len(p):
-        c=p[i]
-        if esc:
-            esc=False
-        elif c=="\\":
-            esc=True
-        elif in_class:
-            if c=="]":
-                in_class=False
-        else:
-            if c=="[":
-                in_class=True
-            elif c=="(":
-                depth+=1
-            elif c==")":
-                depth-=1
-                if depth==0:
-                    return i
-        i+=1
-    raise ValueError("unbalanced ()")
+# 256-byte lookup tables, one entry per byte value: 1 = accepted, 0 = not.
+CHAR_LUT  = [bytes(c) + b"\1" + bytes(255-c) for c in range(256)]
+ALL_LUT   = b"\1" * 256
+ANY_LUT   = bytes(1 if c != 10 else 0 for c in range(256))      # '.'
+DIGIT_LUT = bytes(1 if chr(c) in DIGITS else 0 for c in range(256))
+WORD_LUT  = bytes(1 if chr(c) in WORD else 0 for c in range(256))
+FLIP      = bytes.maketrans(b"\0\1", b"\1\0")   # lut.translate(FLIP) negates
+MAX_CODE  = 0x10FFFF    # last Unicode code point
 
+# ---------------- regex engine ----------------
 def split_alts(p):
     """
     Split a pattern into top-level alternatives on '|' characters.
@@ -91,257 +76,1129 @@ def split_alts(p):
     out.append(p[start:])
     return out
 
-def count_groups(p):
+def next_atom(p, utf8=False):
     """
-    Count how many '(' groups exist at any depth, ignoring [...] and escapes.
-    Used to advance the global group numbering when we dive into a subpattern.
-    """
-    n=0; in_class=False; esc=False
-    for c in p:
-        if esc: esc=False; continue
-        if c=="\\": esc=True; continue
-        if in_class:
-            if c=="]": in_class=False
-            continue
-        if c=="[": in_class=True; continue
-        if c=="(": n+=1
-    return n
-
-def next_atom(p):
-    """
-    Parse the next *atom* from the pattern and return (predicate, rest).
-    The predicate is a one-char test function f(ch)->bool.
+    Parse the next *atom* from the pattern and return (seqs, rest).
+    seqs lists the byte sequences the atom accepts, each a tuple of
+    256-byte tables (lut[c] is 1 if that byte may be c, else 0): a single
+    table for ASCII, one table per byte of the UTF-8 encoding otherwise.
     It handles '.', character classes, escapes like \d \w, and literals.
 
+    With utf8, '.' and classes cover every character they name, as UTF-8.
+    Without it they only have to be right on ASCII input, which lets '.'
+    and negated classes stay single-byte tables.
+
     If the pattern is empty, returns (None, "").
     """
     if not p: return None, ""
     if p[0] == ".":  # any char except newline
-        return (lambda ch: ch != "\n"), p[1:]
+        return class_seqs("\n", True, utf8), p[1:]
     if p.startswith("[^]"):  # special case: anything at all
-        return (lambda ch: True), p[3:]
+        return class_seqs("", True, utf8), p[3:]
     if p.startswith("[^"):
-        # Negative class: collect explicit chars until ']'
-        j=p.index("]"); bad=set(p[2:j])
-        return (lambda ch,bad=bad: ch not in bad), p[j+1:]
+        # Negative class: explicit chars until ']'
+        j=p.index("]")
+        return class_seqs(p[2:j], True, utf8), p[j+1:]
     if p[0] == "[":
-        # Positive class: any char in the set
-        j=p.index("]"); good=set(p[1:j])
-        return (lambda ch,good=good: ch in good), p[j+1:]
+        # Positive class: any char listed
+        j=p.index("]")
+        return class_seqs(p[1:j], False, utf8), p[j+1:]
     if p[0] == "\\":
         # Escapes we support: \d, \w, and "\<char>" meaning literal <char>
-        if len(p)<2: return (lambda ch: ch=="\\"), ""
+        if len(p)<2: return char_seqs("\\"), ""
         t=p[1]
-        if   t=="d": return (lambda ch: ch in DIGITS), p[2:]
-        elif t=="w": return (lambda ch: ch in WORD),   p[2:]
-        else:        return (lambda ch,t=t: ch==t),    p[2:]
+        if   t=="d": return [(DIGIT_LUT,)], p[2:]
+        elif t=="w": return [(WORD_LUT,)],  p[2:]
+        else:        return char_seqs(t), p[2:]
     # Literal single character
-    c=p[0]; return (lambda ch,c=c: ch==c), p[1:]
-
-def try_backref(s,p,caps):
-    """
-    If pattern at p starts with a backreference like \1 or \12:
-      - Check the captured group string (caps is a list of group texts or None).
-      - If that group exists and matches the front of s, consume it and return (new_s, new_p).
-      - If the group exists but does not match, return False (a hard dead-end).
-      - If no backref syntax is present at p, return None (no decision here).
-
-    Backrefs use 1-based indexing like standard regexes.
-    """
-    if not p.startswith("\\") or len(p)<2 or not p[1].isdigit(): return None
-    j=2
-    while j<len(p) and p[j].isdigit(): j+=1
-    idx=int(p[1:j])-1
-    if idx<0 or idx>=len(caps) or caps[idx] is None: return False
-    g=caps[idx]
-    if not s.startswith(g): return False
-    return s[len(g):], p[j:]
-
-def gen(s,p,caps,gi):
-    """
-    Core backtracking matcher. Yields pairs (remaining_string, updated_captures)
-    for every way the prefix of 's' can match the prefix of 'p'.
-
-    Parameters:
-      s   -> the part of the input we have not yet matched
-      p   -> the part of the pattern we have not yet matched
-      caps-> list of captured group texts (by index). Entries may be None.
-      gi  -> next group index to assign for '(' we see here
-
-    Strategy:
-      - If we hit end of pattern, yield success (whatever is left of 's').
-      - If pattern is a backreference, try to match that exact captured text.
-      - If we see a '(' group:
-          • find its ')'
-          • for each top-level alternative inside, try to match it
-          • record the substring that group consumed into caps[this_id]
-          • handle quantifiers '+', '?' applied to the group as a unit
-      - Otherwise read a single-char atom and honor '+', '?' on it.
-
-    This is small, explicit backtracking. No DFA construction. Readable over fast.
-    """
-    if p == "":
-        yield s, caps; return
-
-    # 1) Backreference check (\1, \2, ...)
-    br = try_backref(s,p,caps)
-    if br is False: return
-    if br is not None:
-        s2, p2 = br
-        yield from gen(s2,p2,caps,gi); return
-
-    # 2) Group handling: ( ... ) with optional + or ? after it
-    if p[0] == "(":
-        j = find_close(p,0)
-        body, rest = p[1:j], p[j+1:]
-        q = rest[0] if rest else ""   # quantifier after the group if any
-        this_id = gi                  # id for this '('
-        inner_start = gi + 1          # groups inside start after this one
-        span = 1 + count_groups(body) # how many ids we consume total
-
-        def gen_body(s0, caps0):
-            """
-            Try each alternative inside the group on s0.
-            On success, set caps[this_id] to the substring that matched the group.
-            """
-            for alt in split_alts(body):
-                # Ensure caps list is long enough
-                cc = caps0[:] + [None]*max(0,this_id+1-len(caps0))
-                for out_s, cc2 in gen(s0, alt, cc, inner_start):
-                    cc3 = cc2[:] + [None]*max(0,this_id+1-len(cc2))
-                    # The group's text is what we consumed from s0
-                    cc3[this_id] = s0[:len(s0)-len(out_s)]
-                    yield out_s, cc3
-
-        if q == "+":
-            # One or more repetitions of the whole group.
-            rest2 = rest[1:]
-            # Seed with one match of the body; then keep stacking more.
-            stack = list(gen_body(s, caps))
-            while stack:
-                out_s, ccx = stack.pop()
-                # After k repetitions, try to match the rest of the pattern.
-                yield from gen(out_s, rest2, ccx, gi + span)
-                # If we consumed at least one char, try to grow to k+1 reps.
-                if len(out_s) < len(s):
-                    for out2, cc2 in gen_body(out_s, ccx):
-                        if len(out2) != len(out_s):
-                            stack.append((out2, cc2))
-            return
-
-        if q == "?":
-            # Zero or one repetition of the whole group.
-            rest2 = rest[1:]
-            for out_s, ccx in gen_body(s, caps):
-                yield from gen(out_s, rest2, ccx, gi + span)
-            # Also try skipping the group entirely.
-            yield from gen(s, rest2, caps[:], gi + span)
-            return
-
-        # No quantifier: exactly one occurrence of the group.
-        for out_s, ccx in gen_body(s, caps):
-            yield from gen(out_s, rest, ccx, gi + span)
-        return
-
-    # 3) Single-character atom with optional + or ?
-    f, rest = next_atom(p)
-    if f is None: return
-    q = rest[0] if rest else ""
-
-    if q == "+":
-        # One or more of this atom.
-        tail = rest[1:]
-        if not s or not f(s[0]): return
-        # Find the maximal run of matching chars, then backtrack downwards.
-        i=1
-        while i<=len(s) and f(s[i-1]): i+=1
-        i-=1
-        for k in range(i,0,-1):
-            yield from gen(s[k:], tail, caps[:], gi)
-        return
-
-    if q == "?":
-        # Zero or one of this atom.
-        tail = rest[1:]
-        if s and f(s[0]): yield from gen(s[1:], tail, caps[:], gi)
-        yield from gen(s, tail, caps[:], gi)
-        return
-
-    # Exactly one char must match.
-    if not s or not f(s[0]): return
-    yield from gen(s[1:], rest, caps, gi)
+    return char_seqs(p[0]), p[1:]
+
+def char_seqs(ch):
+    """The one byte sequence for the literal character ch."""
+    return [tuple(CHAR_LUT[b] for b in ch.encode("utf-8", "surrogatepass"))]
+
+@functools.lru_cache(maxsize=256)
+def class_seqs(body, negate, utf8):
+    """
+    Byte sequences (see next_atom) for the class '[body]' ('[^body]' if
+    negate). 'a-z' is a range of code points (a '-' first or last is
+    literal). All ASCII members share one table; with utf8 the others are
+    spelled out as UTF-8 byte ranges (see _utf8_ranges). Without utf8 only
+    the ASCII members count, and negation just flips the table.
+    Cached, so identical classes share their tables.
+    Raises ValueError on a reversed range like 'z-a'.
+    """
+    ranges = []
+    i = 0
+    while i < len(body):
+        if i + 2 < len(body) and body[i+1] == "-":
+            lo, hi = ord(body[i]), ord(body[i+2])
+            if lo > hi: raise ValueError("bad range in []")
+            i += 3
+        else:
+            lo = hi = ord(body[i])
+            i += 1
+        ranges.append((lo, hi))
+    if negate and utf8:
+        # complement over all code points
+        out, lo = [], 0
+        for a, b in sorted(ranges):
+            if a > lo: out.append((lo, a - 1))
+            lo = max(lo, b + 1)
+        if lo <= MAX_CODE: out.append((lo, MAX_CODE))
+        ranges, negate = out, False
+    lut = bytearray(256)
+    for lo, hi in ranges:
+        if lo < 0x80: lut[lo:min(hi, 0x7F)+1] = b"\1" * (min(hi, 0x7F) - lo + 1)
+    lut = bytes(lut)
+    if not utf8:
+        return [(lut.translate(FLIP) if negate else lut,)]
+    seqs = [(lut,)] if 1 in lut else []
+    for lo, hi in ranges:
+        if hi >= 0x80:
+            seqs += [tuple(_span_lut(a, b) for a, b in rs)
+                     for rs in _utf8_ranges(max(lo, 0x80), hi)]
+    return seqs or [(bytes(256),)]
+
+@functools.lru_cache(maxsize=None)
+def _span_lut(a, b):
+    """Lookup table accepting the bytes a..b."""
+    return bytes(a) + b"\1" * (b-a+1) + bytes(255-b)
+
+def _utf8_ranges(lo, hi):
+    """
+    The UTF-8 encodings of code points lo..hi (all >= 0x80), as a list of
+    byte range sequences: [((0xC2, 0xDF), (0x80, 0xBF))] for 0x80..0x7FF.
+    The range is split until, in each piece, every byte of the encoding
+    may vary independently between the first and last code point's byte.
+    Surrogates have no encoding and are left out.
+    """
+    out, todo = [], [(lo, hi)]
+    while todo:
+        lo, hi = todo.pop()
+        if lo > hi: continue
+        if lo <= 0xDFFF and hi >= 0xD800:
+            todo += [(lo, 0xD7FF), (0xE000, hi)]; continue
+        for m in (0x7FF, 0xFFFF):               # one encoded length at a time
+            if lo <= m < hi:
+                todo += [(lo, m), (m + 1, hi)]; break
+        else:
+            for k in (1, 2, 3):                 # then align on continuation bytes
+                m = (1 << 6*k) - 1
+                if lo & ~m == hi & ~m: continue
+                if lo & m:
+                    todo += [(lo, lo | m), ((lo | m) + 1, hi)]; break
+                if hi & m != m:
+                    todo += [(lo, (hi & ~m) - 1), (hi & ~m, hi)]; break
+            else:
+                out.append(tuple(zip(chr(lo).encode(), chr(hi).encode())))
+    return out
+
+def backrefs(p):
+    """
+    Return the set of group numbers referenced by \1, \2, ... anywhere in p.
+    Skips [...] classes the same way next_atom reads them (up to the first ']').
+    An empty set means the pattern needs no captures at all.
+    """
+    out=set(); in_class=False; i=0
+    while i < len(p):
+        c=p[i]
+        if in_class:
+            if c=="]": in_class=False
+        elif c=="[":
+            in_class=True
+        elif c=="\\":
+            j=i+1
+            while j<len(p) and p[j] in DIGITS: j+=1
+            if j>i+1: out.add(int(p[i+1:j]))
+            i=max(j,i+2); continue
+        i+=1
+    return out
+
+def _anchors(p):
+    """
+    Split one alternative into (bol, core, eol):
+      "^abc$" -> (True, "abc", True)
+    A trailing '$' only counts as an anchor when it is not escaped ('\$').
+    """
+    bol = p.startswith("^")
+    if bol: p = p[1:]
+    eol = p.endswith("$") and (len(p) - 1 - len(p[:-1].rstrip("\\"))) % 2 == 0
+    if eol: p = p[:-1]
+    return bol, p, eol
+
+# ---- bit-parallel NFA (patterns without backrefs) ----
+#
+# A backref-free pattern is compiled once into a Glushkov automaton: one
+# state ("position") per atom byte, plus two start states: 0 for "at
+# the start of the input" and 1 for "a match may start here". A set of
+# active states is a plain int used as a bitmask, so stepping over one
+# input byte is
+#
+#     D = (follow(D) & B[c]) | start
+#
+# where B[c] holds the positions whose atom accepts byte c. follow(D) is
+# the union of the follow sets of every state in D; it only depends on D.
+# No backtracking happens, so '(a|a)+b' is as cheap as 'ab'. Top-level
+# alternatives share one automaton: a '^' alternative hangs off state 0
+# only, a '$' one has its last positions accepted at the end only.
+#
+# The automaton steps over UTF-8 bytes. On a line with non-ASCII text an
+# atom becomes the byte sequences of the characters it accepts (see
+# next_atom), so '.' still consumes one whole character.
+#
+# The step itself is also cached: each D that shows up gets a small id and
+# a row of 256 successor ids, filled in the first time a byte is seen from
+# that state (a lazily built DFA). Once warm, the inner loop is a single
+# table lookup per input byte, with no bit twiddling left in Python.
+
+DFA_STATES = 1024   # drop the table and start over past this many states
+
+class Nfa:
+    """
+    Compiled form of a backref-free pattern (all its alternatives).
+
+      B       -> list of 256 masks, B[c] = positions whose atom accepts byte c
+      follow  -> follow[i] = positions that may come right after position i
+                 (follow[0] / follow[1]: positions a match can start with at
+                 the start of the input / anywhere else)
+      accept  -> positions a match can end on (start bits for an empty match)
+      at_end  -> the same, for alternatives anchored with '$'
+      start   -> bits OR-ed in after every byte (state 1, unless every
+                 alternative is anchored with '^')
+
+    Lazy DFA, indexed by state id (id 0 is the initial D = 1):
+      ids     -> D -> id
+      masks   -> id -> D
+      fol     -> id -> follow(D)
+      rows    -> id -> 256 successor ids (None = not computed yet)
+      stop    -> id -> True/False once the answer is known (accepting D
+                 without '$', or no live state left); None to keep going
+      final   -> id -> does D accept at the end of the input?
+    """
+    __slots__ = ("B", "follow", "accept", "at_end", "start",
+                 "ids", "masks", "fol", "rows", "stop", "final")
+
+    def __init__(self, B, follow, accept, at_end, start):
+        self.B=B; self.follow=follow; self.accept=accept
+        self.at_end=at_end; self.start=start
+        self.ids={}; self.masks=[]; self.fol=[]; self.rows=[]
+        self.stop=[]; self.final=[]
+        self.state(1)
+
+    def state(self, D):
+        """Return the id for D, adding it to the DFA table if new."""
+        sid = self.ids.get(D)
+        if sid is not None: return sid
+        if len(self.masks) >= DFA_STATES:
+            self.ids.clear(); del self.masks[:], self.fol[:], self.rows[:]
+            del self.stop[:], self.final[:]
+            self.state(1)
+        t = 0; i = 0; m = D
+        while m:
+            if m & 1: t |= self.follow[i]
+            m >>= 1; i += 1
+        sid = self.ids[D] = len(self.masks)
+        self.masks.append(D); self.fol.append(t); self.rows.append([None]*256)
+        self.stop.append(True if D & self.accept else False if not D else None)
+        self.final.append(D & (self.accept | self.at_end) != 0)
+        return sid
+
+    def step(self, sid, c):
+        """Compute and record the successor of state sid on byte c."""
+        row = self.rows[sid]   # stays valid even if state() resets the table
+        row[c] = nid = self.state((self.fol[sid] & self.B[c]) | self.start)
+        return nid
+
+def _link(follow, last, first):
+    """Every position in the mask 'last' may be followed by any in 'first'."""
+    i=0
+    while last:
+        if last & 1: follow[i] |= first
+        last >>= 1; i += 1
+
+@functools.lru_cache(maxsize=256)
+def compile_nfa(p, utf8=False):
+    """
+    Compile a pattern into one Nfa, all top-level alternatives included.
+    utf8 as in next_atom: an atom that spans several bytes gets one
+    position per byte, chained, for each of its byte sequences.
+    Returns None if the pattern uses backrefs; those need the VM.
+    Raises ValueError on unbalanced parentheses, like compile_program.
+    """
+    if backrefs(p): return None
+    B = [0]*256
+    follow = [0, 0]
+
+    def build(core):
+        """
+        Return (first, last, nullable) masks for core, in one left-to-right
+        pass. Each open '(' pushes the enclosing group's state on a stack:
+        alt = masks of its finished alternatives, seq = the current one.
+        """
+        stack = []
+        alt, seq = [0, 0, False], [0, 0, True]
+        i, n = 0, len(core)
+        while i < n or stack:
+            if i == n: raise ValueError("unbalanced ()")
+            c = core[i]
+            if c == "(":
+                stack.append((alt, seq))
+                alt, seq = [0, 0, False], [0, 0, True]
+                i += 1; continue
+            if c == "|":
+                alt = [alt[0] | seq[0], alt[1] | seq[1], alt[2] or seq[2]]
+                seq = [0, 0, True]
+                i += 1; continue
+            if c == ")" and stack:
+                f, l, nl = alt[0] | seq[0], alt[1] | seq[1], alt[2] or seq[2]
+                alt, seq = stack.pop()
+                i += 1
+            else:
+                seqs, rest = next_atom(core[i:], utf8)
+                i = n - len(rest)
+                f = l = 0; nl = False
+                for bseq in seqs:
+                    prev = 0
+                    for lut in bseq:
+                        bit = 1 << len(follow)
+                        follow.append(0)
+                        for b, hit in enumerate(lut):
+                            if hit: B[b] |= bit
+                        if prev: _link(follow, prev, bit)
+                        else: f |= bit
+                        prev = bit
+                    l |= prev
+            q = core[i] if i < n else ""
+            if q == "+":
+                _link(follow, l, f); i += 1
+            elif q == "?":
+                nl = True; i += 1
+            # concatenate (f,l,nl) onto the current alternative
+            _link(follow, seq[1], f)
+            if seq[2]: seq[0] |= f
+            seq[1] = (seq[1] | l) if nl else l
+            seq[2] = seq[2] and nl
+        return alt[0] | seq[0], alt[1] | seq[1], alt[2] or seq[2]
+
+    accept = at_end = start = 0
+    for alt in split_alts(p):
+        bol, core, eol = _anchors(alt)
+        first, last, nullable = build(core)
+        follow[0] |= first
+        if not bol: follow[1] |= first; start = 2
+        if nullable: last |= 1 if bol else 3
+        if eol: at_end |= last
+        else:   accept |= last
+    return Nfa(B, follow, accept, at_end, start)
+
+def nfa_search(data, nfa):
+    """
+    Run a compiled Nfa over the bytes 'data'.
+    True if it matches anywhere (or at the start/end, if anchored).
+    """
+    rows=nfa.rows; stop=nfa.stop
+    sid = 0
+    if stop[0] is not None: return stop[0]
+    for c in data:
+        nxt = rows[sid][c]
+        if nxt is None: nxt = nfa.step(sid, c)
+        sid = nxt
+        if stop[sid] is not None: return stop[sid]
+    return nfa.final[sid]
+
+# ---- bytecode VM (patterns with backrefs) ----
+#
+# Backrefs make the language non-regular, so these patterns are compiled
+# once into a flat Program and run by a small backtracking VM. The VM
+# state is (pc, sp, caps, opens):
+#   pc    -> index into Program.ops
+#   sp    -> offset into the input bytes
+#   caps  -> (start, end) of each group some \N refers to (None if unset)
+#   opens -> input offset where each of those groups was last entered
+# The outcome of a state depends on nothing else, so every state reached
+# at a SPLIT is explored at most once: if we see it again it either failed
+# already or is still being explored further up the stack. Every loop goes
+# through a SPLIT, so this also stops empty loops like '(a?)+'. Groups
+# nobody refers to get no SAVE instructions, which keeps states few.
+#
+# 'x+' on a single-byte atom is one RUN instruction rather than a loop:
+# the longest run of accepted bytes is measured by one re.match call (a
+# plain class scan in C), and the shorter lengths are pushed for
+# backtracking, longest tried first.
+#
+# Many choices are settled by the next input byte alone. If nothing that
+# can follow a RUN starts with a byte the RUN accepts, giving bytes back
+# can never help, so the RUN is POSSESSIVE and pushes nothing. Likewise a
+# SPLIT whose branches must each consume a byte first, from disjoint sets
+# (like the loop in '(ab)+c', or '(cat|dog)'), becomes a GUARD that peeks
+# at the next byte and takes the only branch that can succeed.
+
+CHAR, CLASS, ANY, SPLIT, JMP, SAVE, BACKREF, MATCH, RUN, POSSESSIVE, GUARD = range(11)
+
+def _run_regex(lut):
+    """Compiled regex whose match at sp ends after the run of bytes lut accepts."""
+    members = bytes(c for c in range(256) if lut[c])
+    if not members: return re.compile(b"")
+    return re.compile(b"[" + b"".join(re.escape(members[i:i+1]) for i in range(len(members))) + b"]*")
+
+class Program:
+    """
+    One alternative compiled to instructions (tuples, opcode first):
+      (CHAR, c)       the byte c
+      (CLASS, k)      a byte c with classes[k][c] set (a next_atom table)
+      (ANY,)          any byte except '\\n'
+      (SPLIT, a, b)   try pc a, and failing that pc b
+      (JMP, a)        continue at pc a
+      (SAVE, i)       enter (i=2k) or leave (i=2k+1) the group in capture slot k
+      (BACKREF, k)    the text captured in slot k
+      (MATCH,)        success (only at the end of the input if eol)
+      (RUN, k)        one or more bytes from classes[k], greedy, backtracking
+      (POSSESSIVE, k) as RUN, but always takes the whole run
+      (GUARD, k, b)   go on at pc+1 if the next byte is in classes[k], else at b
+
+    code/arg1/arg2 hold the same instructions as three parallel int lists
+    (missing arguments are 0), which is what vm_search actually reads.
+    runs[k] is the _run_regex for classes[k].
+    minlen/maxlen bound the length of a match (maxlen None = unbounded).
+    """
+    __slots__ = ("ops", "classes", "bol", "eol", "nslots", "code", "arg1", "arg2",
+                 "runs", "minlen", "maxlen")
+
+    def __init__(self, ops, classes, bol, eol, nslots, minlen, maxlen):
+        self.ops=ops; self.classes=classes
+        self.bol=bol; self.eol=eol; self.nslots=nslots
+        self.minlen=minlen; self.maxlen=maxlen
+        self.code = [op[0] for op in ops]
+        self.arg1 = [op[1] if len(op) > 1 else 0 for op in ops]
+        self.arg2 = [op[2] if len(op) > 2 else 0 for op in ops]
+        self.runs = [_run_regex(lut) for lut in classes]
+
+@functools.lru_cache(maxsize=256)
+def compile_program(p, utf8=False):
+    """
+    Compile one alternative into a Program (utf8 as in next_atom).
+    Groups are numbered 1, 2, ... in '(' order within the alternative.
+    Raises ValueError on unbalanced parentheses or an unclosed '['.
+
+    Pass 1 reads the pattern once into a small tree:
+      ("seq", [items])  ("alt", [seqs])  ("rep", item, "+"|"?")
+      ("group", slot, alt)  ("op", instruction)
+    An atom of several bytes is a group without a slot, with one
+    alternative per byte sequence.
+    Pass 2 lays the tree out as instructions.
+    Pass 3 turns RUNs and SPLITs that the next byte decides into
+    POSSESSIVE and GUARD instructions.
+
+    Without '^', a leading 'x+' only needs its last 'x' and a leading 'x?'
+    can go entirely (x a single-byte atom): the search may start anywhere,
+    so it can start right there. Without '$', the same holds at the end.
+    """
+    bol, core, eol = _anchors(p)
+    used = sorted(backrefs(core))
+    n = len(core)
+    classes = []; class_ids = {}
+    group = [0]
+
+    def atom(i):
+        """Read one atom at i; return (tree node, index after it)."""
+        if core[i] == "\\" and i+1 < n and core[i+1] in DIGITS:
+            j = i+1
+            while j<n and core[j] in DIGITS: j+=1
+            return ("op", (BACKREF, used.index(int(core[i+1:j])))), j
+        seqs, rest = next_atom(core[i:], utf8)
+        j = n - len(rest)
+        if len(seqs) == 1 and len(seqs[0]) == 1: return ("op", op_of(seqs[0][0])), j
+        return ("group", None, ("alt", [("seq", [("op", op_of(lut)) for lut in seq])
+                                        for seq in seqs])), j
+
+    def op_of(lut):
+        """The single-byte instruction for a table from next_atom."""
+        if lut == ANY_LUT: return (ANY,)
+        if lut.count(1) == 1: return (CHAR, lut.index(1))
+        return (CLASS, cls(lut))
+
+    def cls(lut):
+        """Index of lut in classes, adding it if new."""
+        if lut not in class_ids:
+            class_ids[lut] = len(classes); classes.append(lut)
+        return class_ids[lut]
+
+    def lut_of(op):
+        """The byte table a single-byte instruction accepts."""
+        if op[0] == CHAR: return CHAR_LUT[op[1]]
+        if op[0] == ANY: return ANY_LUT
+        return classes[op[1]]
+
+    def alternation(i, depth):
+        """Read alternatives up to a closing ')' (or the end at depth 0)."""
+        seqs = []; items = []
+        while i < n:
+            c = core[i]
+            if c == "|":
+                seqs.append(("seq", items)); items = []; i += 1
+                continue
+            if c == ")" and depth:
+                break
+            if c == "(":
+                group[0] += 1
+                slot = used.index(group[0]) if group[0] in used else None
+                body, i = alternation(i+1, depth+1)
+                if i >= n: raise ValueError("unbalanced ()")
+                item = ("group", slot, body); i += 1
+            else:
+                item, i = atom(i)
+            if i < n and core[i] in "+?":
+                item = ("rep", item, core[i]); i += 1
+            items.append(item)
+        seqs.append(("seq", items))
+        return ("alt", seqs), i
+
+    tree, _ = alternation(0, 0)
+    items = tree[1][0][1] if len(tree[1]) == 1 else []
+    for free, end in ((not bol, 0), (not eol, -1)):
+        while free and items and items[end][0] == "rep" and items[end][1][0] == "op" \
+                and items[end][1][1][0] in (CHAR, CLASS, ANY):
+            if items[end][2] == "+":
+                items[end] = items[end][1]; break
+            items.pop(end)
+
+    ops = []
+
+    def emit(node):
+        """
+        Lay out node's instructions; return (min, max) bytes it can match,
+        max None = unbounded. A group lays out its alternatives and their
+        items in place, so nested groups cost one call each.
+        """
+        kind = node[0]
+        if kind == "op":
+            ops.append(node[1])
+            return (0, None) if node[1][0] == BACKREF else (1, 1)
+        if kind == "rep":
+            if node[2] == "+" and node[1][0] == "op" and node[1][1][0] != BACKREF:
+                ops.append((RUN, cls(lut_of(node[1][1]))))
+                return 1, None
+            start = len(ops)
+            if node[2] == "?": ops.append(None)     # SPLIT L, next; L: x
+            lo, hi = emit(node[1])
+            if node[2] == "?":
+                ops[start] = (SPLIT, start+1, len(ops))
+                return 0, hi
+            ops.append((SPLIT, start, len(ops)+1))  # L: x; SPLIT L, next
+            return lo, (0 if hi == 0 else None)
+        slot, seqs = node[1], node[2][1]
+        if slot is not None: ops.append((SAVE, 2*slot))
+        jumps = []; los = []; his = []
+        for k, seq in enumerate(seqs):
+            last = k == len(seqs) - 1
+            if not last: split = len(ops); ops.append(None)
+            lo, hi = 0, 0
+            for item in seq[1]:
+                a, b = emit(item)
+                lo += a; hi = None if hi is None or b is None else hi + b
+            los.append(lo); his.append(hi)
+            if not last:
+                jumps.append(len(ops)); ops.append(None)
+                ops[split] = (SPLIT, split+1, len(ops))
+        for j in jumps: ops[j] = (JMP, len(ops))
+        if slot is not None: ops.append((SAVE, 2*slot+1))
+        return min(los), (None if None in his else max(his))
+
+    minlen, maxlen = emit(("group", None, tree))
+    ops.append((MATCH,))
+
+    def bits(lut):
+        """lut as an int (byte c of the table is bits 8c..8c+7), for | and &."""
+        return int.from_bytes(lut, "little")
+
+    def first(pc):
+        """
+        (mask, nullable) for code starting at pc: mask (see bits) marks each
+        byte the first consumed byte may be; nullable if MATCH is reachable without
+        consuming anything. A backref may be empty or start with any byte.
+        """
+        mask = 0; nullable = False; todo = [pc]; done = set()
+        while todo:
+            pc = todo.pop()
+            if pc in done: continue
+            done.add(pc)
+            op = ops[pc]
+            if op[0] in (CHAR, CLASS, ANY, RUN):
+                mask |= bits(lut_of(op))
+            elif op[0] == SPLIT:
+                todo += op[1:]
+            elif op[0] == JMP:
+                todo.append(op[1])
+            elif op[0] == MATCH:
+                nullable = True
+            else:  # SAVE, BACKREF
+                if op[0] == BACKREF: mask |= bits(ALL_LUT)
+                todo.append(pc+1)
+        return mask, nullable
+
+    fixed = {}
+    for pc, op in enumerate(ops):
+        if op[0] == RUN and not first(pc+1)[0] & bits(classes[op[1]]):
+            fixed[pc] = (POSSESSIVE, op[1])
+        elif op[0] == SPLIT:
+            (fa, na), (fb, nb) = first(op[1]), first(op[2])
+            if na or nb or not fa or not fb or fa & fb: continue
+            # one branch is always the next instruction; guard on its bytes
+            near, other = (fa, op[2]) if op[1] == pc+1 else (fb, op[1])
+            fixed[pc] = (GUARD, near, other)
+    for pc, op in fixed.items():
+        if op[0] == GUARD:
+            op = (GUARD, cls(op[1].to_bytes(256, "little")), op[2])
+        ops[pc] = op
+    return Program(ops, classes, bol, eol, len(used), minlen, maxlen)
+
+def vm_search(data, prog):
+    """
+    Run a Program over the bytes 'data'; True if it matches anywhere
+    (or at the start/end, if anchored). Iterative: SPLIT pushes its second
+    branch on an explicit stack and falls through into the first.
+    """
+    code=prog.code; arg1=prog.arg1; arg2=prog.arg2
+    classes=prog.classes; runs=prog.runs; eol=prog.eol
+    n=len(data)
+    unset=(None,)*prog.nslots
+    seen=set()
+    stack=[(0,sp,unset,unset) for sp in ((0,) if prog.bol else range(n,-1,-1))]
+    push=stack.append; pop=stack.pop
+    while stack:
+        pc, sp, caps, opens = pop()
+        while True:
+            op = code[pc]
+            if op == CHAR:
+                if sp >= n or data[sp] != arg1[pc]: break
+                pc += 1; sp += 1
+            elif op == CLASS:
+                if sp >= n: break
+                if not classes[arg1[pc]][data[sp]]: break
+                pc += 1; sp += 1
+            elif op == ANY:
+                if sp >= n or data[sp] == 10: break
+                pc += 1; sp += 1
+            elif op == SPLIT:
+                st = (pc, sp, caps, opens)
+                if st in seen: break
+                seen.add(st)
+                push((arg2[pc], sp, caps, opens))
+                pc = arg1[pc]
+            elif op == JMP:
+                pc = arg1[pc]
+            elif op == SAVE:
+                k = arg1[pc] >> 1
+                if arg1[pc] & 1:
+                    caps = caps[:k] + ((opens[k], sp),) + caps[k+1:]
+                else:
+                    opens = opens[:k] + (sp,) + opens[k+1:]
+                pc += 1
+            elif op == BACKREF:
+                g = caps[arg1[pc]]
+                if g is None: break
+                a, b = g
+                if b > a:
+                    if not data.startswith(data[a:b], sp): break
+                    sp += b - a
+                pc += 1
+            elif op == GUARD:
+                if sp >= n: break
+                pc = pc + 1 if classes[arg1[pc]][data[sp]] else arg2[pc]
+            elif op == POSSESSIVE:
+                end = runs[arg1[pc]].match(data, sp).end()
+                if end == sp: break
+                pc += 1; sp = end
+            elif op == RUN:
+                st = (pc, sp, caps, opens)
+                if st in seen: break
+                seen.add(st)
+                end = runs[arg1[pc]].match(data, sp).end()
+                if end == sp: break
+                pc += 1
+                for k in range(sp+1, end): push((pc, k, caps, opens))
+                sp = end
+            else:  # MATCH
+                if not eol or sp == n: return True
+                break
+    return False
+
+# ---- optional: Hyperscan (patterns without backrefs) ----
+#
+# If the hyperscan module is installed, backref-free patterns are handed
+# to it instead of the NFA. The pattern is translated from what next_atom
+# reads, not from its text: every atom becomes a \xHH byte or an explicit
+# byte class, so \d, \w, ranges and [^] need no special cases and bytes
+# mean the same thing on both sides. Anything Hyperscan rejects simply
+# stays on our own engines.
+
+def _pcre_atom(lut):
+    """PCRE for the bytes a lookup table accepts."""
+    if lut == ANY_LUT: return "."   # no DOTALL: '.' skips '\n' there too
+    spans = []
+    for c in range(256):
+        if not lut[c]: continue
+        if spans and spans[-1][1] == c - 1: spans[-1][1] = c
+        else: spans.append([c, c])
+    if not spans: return "[^\\x00-\\xff]"
+    if len(spans) == 1 and spans[0][0] == spans[0][1]: return "\\x%02x" % spans[0][0]
+    return "[" + "".join("\\x%02x" % a if a == b else "\\x%02x-\\x%02x" % (a, b)
+                         for a, b in spans) + "]"
+
+def to_pcre(p, utf8=False):
+    """
+    Translate a backref-free pattern into PCRE bytes (utf8 as in
+    next_atom): groups become (?:...), '+'/'?' pass through where they are
+    quantifiers (elsewhere they are literals, as in compile_program), and
+    '$' becomes '\\z' (PCRE's '$' also matches before a final '\\n').
+    """
+    out = []
+    for alt in split_alts(p):
+        bol, core, eol = _anchors(alt)
+        s = ["^(?:" if bol else "(?:"]
+        i, n, depth, piece = 0, len(core), 0, False
+        while i < n:
+            c = core[i]
+            if c == "(":
+                s.append("(?:"); depth += 1; piece = False; i += 1
+            elif c == ")" and depth:
+                s.append(")"); depth -= 1; piece = True; i += 1
+            elif c == "|":
+                s.append("|"); piece = False; i += 1
+            elif c in "+?" and piece:
+                s.append(c); piece = False; i += 1
+            else:
+                seqs, rest = next_atom(core[i:], utf8)
+                if len(seqs) == 1 and len(seqs[0]) == 1:
+                    s.append(_pcre_atom(seqs[0][0]))
+                else:
+                    s.append("(?:" + "|".join("".join(map(_pcre_atom, seq)) for seq in seqs) + ")")
+                piece = True; i = n - len(rest)
+        if depth: raise ValueError("unbalanced ()")
+        s.append(")\\z" if eol else ")")
+        out.append("".join(s))
+    return "|".join(out).encode("latin-1")
+
+HS_MIN_LEN = 32     # a scan costs what the warm DFA spends on ~30 bytes
+
+def compile_hs(p, utf8=False):
+    """
+    A Hyperscan database for p (utf8 as in next_atom), or None: module not
+    installed, backrefs, or a pattern it will not compile.
+    """
+    if hyperscan is None or backrefs(p): return None
+    try:
+        db = hyperscan.Database()
+        db.compile(expressions=[to_pcre(p, utf8)], ids=[0], elements=1,
+                   flags=[hyperscan.HS_FLAG_SINGLEMATCH | hyperscan.HS_FLAG_ALLOWEMPTY])
+    except Exception:
+        return None
+    return db
+
+def _hs_stop(*args):
+    """Hyperscan match callback: the first match settles it, stop there."""
+    return True
+
+def hs_search(data, db):
+    """Does the Hyperscan database match somewhere in the bytes data?"""
+    try:
+        db.scan(data, match_event_handler=_hs_stop)
+    except hyperscan.ScanTerminated:
+        return True
+    return False
+
+def extract_required_literal(prog):
+    """
+    Return the longest run of bytes every match of prog must contain, or None.
+
+    An instruction lies on every path to MATCH unless a jump from before it
+    lands after it (alternatives, '?'). Consecutive CHARs that all lie on
+    every path (SAVE is zero-width, so it does not break the run) spell out
+    text that must appear verbatim in any matching line.
+    """
+    best = run = b""
+    reach = 0   # furthest pc any earlier jump can land on
+    for pc, op in enumerate(prog.ops):
+        if reach > pc:
+            run = b""
+        elif op[0] == CHAR:
+            run += bytes((op[1],))
+            if len(run) > len(best): best = run
+        elif op[0] in (RUN, POSSESSIVE) and prog.classes[op[1]].count(1) == 1:
+            # 'c+': the text around it joins at one of the c's
+            c = bytes((prog.classes[op[1]].index(1),))
+            run += c
+            if len(run) > len(best): best = run
+            run = c
+        elif op[0] != SAVE:
+            run = b""
+        if op[0] == SPLIT: reach = max(reach, op[1], op[2])
+        elif op[0] == GUARD: reach = max(reach, op[2])
+        elif op[0] == JMP: reach = max(reach, op[1])
+    return best or None
+
+@functools.lru_cache(maxsize=256)
+def required_literal(p):
+    """
+    Bytes that every line matching p must contain, or None.
+    Lines without them can be skipped with a plain substring test.
+    """
+    if len(split_alts(p)) > 1: return None
+    return extract_required_literal(compile_program(p, True))
+
+def _dots(prog):
+    """
+    For a program that is '.'s, then a literal, then '.'s (each '.' maybe
+    with '+', as in '.+foo' or '^..foo.+$'), return
+      (literal, dots before, dots after, '+' before?, '+' after?, bol, eol)
+    else None. See dots_search for how that is matched.
+    """
+    ops = prog.ops[:-1]
+    def dot(op):
+        return op[0] == ANY or (op[0] in (RUN, POSSESSIVE) and prog.classes[op[1]] == ANY_LUT)
+    i = 0
+    while i < len(ops) and dot(ops[i]): i += 1
+    j = i
+    while j < len(ops) and ops[j][0] == CHAR: j += 1
+    if j == i or (i == 0 and j == len(ops)) or not all(map(dot, ops[j:])):
+        return None
+    lead, trail = ops[:i], ops[j:]
+    return (bytes(op[1] for op in ops[i:j]), len(lead), len(trail),
+            any(op[0] != ANY for op in lead), any(op[0] != ANY for op in trail),
+            prog.bol, prog.eol)
+
+def dots_search(data, spec):
+    """
+    Run a "dots" plan. On a line without '\n' (every line the CLI reads)
+    '.' takes any byte, so the pattern matches iff the literal occurs where
+    the dots on each side fit: one find() over that range of positions.
+    Anything else goes to the NFA.
+    """
+    lit, before, after, lead_run, trail_run, bol, eol, nfa = spec
+    if 10 in data: return nfa_search(data, nfa)
+    last = len(data) - len(lit) - after     # last position that leaves room after
+    lo, hi = before, last
+    if bol and not lead_run: hi = min(hi, before)
+    if eol and not trail_run: lo = max(lo, last)
+    return lo <= hi and data.find(lit, lo, hi + len(lit)) >= 0
+
+def _plan(alt, utf8):
+    """
+    Decide once how to search for one top-level alternative (utf8 as in
+    next_atom):
+      ("in"|"prefix"|"suffix"|"equal", text, None)
+                         -> a plain literal, tested with str-like methods
+      ("dots", spec, None) -> a literal with only '.'s around it (see _dots)
+      ("nfa", nfa, tail) -> bit-parallel NFA
+      ("vm", prog, None) -> bytecode VM (backrefs)
+      ("hs", (db, nfa), None)
+                         -> Hyperscan on long lines, else the NFA (see _plans)
+    tail is set when the alternative ends in '$', has no '^' and always
+    matches exactly tail bytes: the only possible start is then
+    len(s)-tail, so the NFA runs once, anchored, over the last tail bytes.
+    """
+    prog = compile_program(alt, utf8)
+    if all(op[0] == CHAR for op in prog.ops[:-1]):
+        kind = ("in", "suffix", "prefix", "equal")[2*prog.bol + prog.eol]
+        return (kind, bytes(op[1] for op in prog.ops[:-1]), None)
+    if prog.nslots:
+        return ("vm", prog, None)
+    spec = _dots(prog)
+    if spec is not None:
+        return ("dots", spec + (compile_nfa(alt, utf8),), None)
+    if prog.eol and not prog.bol and prog.minlen == prog.maxlen:
+        return ("nfa", compile_nfa("^" + alt, utf8), prog.minlen)
+    return ("nfa", compile_nfa(alt, utf8), None)
+
+class Pattern:
+    """
+    A whole pattern, compiled: the plans (see _plan) to try in turn, for
+    ASCII lines (plans) and for the rest (uplans, which read UTF-8).
+    """
+    __slots__ = ("source", "plans", "uplans", "literal")
+    def __init__(self, source, plans, uplans, literal):
+        self.source, self.plans, self.uplans = source, plans, uplans
+        self.literal = literal
+
+def _plans(pat, utf8):
+    """
+    The plans for pat. Each top-level alternative numbers its own groups
+    from 1, so '(a)b|(c)\\1' matches "cc". Alternatives that would each
+    run an NFA are merged into a single one, so one pass over the line
+    decides them all; literals and backrefs keep their own plans, cheapest
+    first. With Hyperscan installed, that NFA also gets a database for
+    long lines, unless it only runs from the start or end of the line,
+    where the DFA is usually done after a few bytes.
+    """
+    plans, nfas = [], []
+    for alt in split_alts(pat):
+        plan = _plan(alt, utf8)
+        if plan[0] == "nfa": nfas.append((alt, plan))
+        else: plans.append(plan)
+    if nfas:
+        joined = "|".join(alt for alt, _ in nfas)
+        if len(nfas) > 1:
+            plan = ("nfa", compile_nfa(joined, utf8), None)
+        else:
+            plan = nfas[0][1]
+        if plan[2] is None and plan[1].start:
+            db = compile_hs(joined, utf8)
+            if db is not None: plan = ("hs", (db, plan[1]), None)
+        plans.append(plan)
+    plans.sort(key=lambda plan: plan[0] == "vm")
+    return tuple(plans)
+
+@functools.lru_cache(maxsize=256)
+def _compile(pat):
+    """
+    Parse and plan pat once. Raises ValueError on a malformed pattern.
+    An ASCII line can only match ASCII characters, so its plans treat '.'
+    and classes as single bytes; other lines get plans that step over
+    whole UTF-8 characters. Without '.', '[' or non-ASCII the two agree.
+    """
+    plans = _plans(pat, False)
+    if pat.isascii() and "." not in pat and "[" not in pat:
+        uplans = plans
+    else:
+        uplans = _plans(pat, True)
+    return Pattern(pat, plans, uplans, required_literal(pat))
+
+def search(pattern, data):
+    """
+    Does the compiled pattern match somewhere in the bytes data? data is
+    read as UTF-8; bytes that are not valid UTF-8 are ignored.
+    """
+    if data.isascii():
+        plans = pattern.plans
+    else:
+        plans = pattern.uplans
+        try:
+            str(data, "utf-8")
+        except UnicodeDecodeError:
+            data = data.decode("utf-8", "ignore").encode("utf-8")
+    for kind, x, tail in plans:
+        if   kind == "in":     hit = x in data
+        elif kind == "prefix": hit = data.startswith(x)
+        elif kind == "suffix": hit = data.endswith(x)
+        elif kind == "equal":  hit = data == x
+        elif kind == "vm":     hit = vm_search(data, x)
+        elif kind == "hs":
+            hit = hs_search(data, x[0]) if len(data) >= HS_MIN_LEN else nfa_search(data, x[1])
+        elif kind == "dots":   hit = dots_search(data, x)
+        elif tail is None:     hit = nfa_search(data, x)
+        else: hit = len(data) >= tail and nfa_search(data[len(data)-tail:], x)
+        if hit: return True
+    return False
 
 def matches(s,p):
     """
-    High-level entry: does string s match pattern p somewhere?
+    High-level entry: does s (bytes, or str to be UTF-8 encoded) match
+    pattern p somewhere?
     Implements grep-like behavior:
       - If ^...$ then require full-string match.
       - If ...$ then require match that ends at end of s.
       - If ^... then require match that starts at start of s.
       - Else search anywhere in the string.
-    Also supports top-level alternation with split_alts.
-    """
-    alts = split_alts(p)
-    if len(alts) > 1:
-        return any(matches(s,a) for a in alts)
-    if p.startswith("^") and p.endswith("$"):
-        return any(out=="" for out,_ in gen(s,p[1:-1],[],0))
-    if p.endswith("$"):
-        core=p[:-1]
-        for i in range(len(s)+1):
-            if any(out=="" for out,_ in gen(s[i:],core,[],0)): return True
-        return False
-    if p.startswith("^"):
-        return any(True for _ in gen(s,p[1:],[],0))
-    for i in range(len(s)+1):
-        if any(True for _ in gen(s[i:],p,[],0)): return True
-    return False
+    Each top-level alternative (split_alts) is tried on its own, with its
+    own anchors; backref-free ones run on the NFA, the rest on the VM.
+    """
+    if isinstance(s, str): s = s.encode("utf-8")
+    return search(_compile(p), s)
 # --------------- end regex engine ---------------
 
-def _emit(s):
-    """Write one line to stdout with a trailing newline. No buffering surprises."""
-    os.write(1, (s + "\n").encode("utf-8"))
+_OUT = bytearray()
 
-def _process_lines(lines, pat, prefix=""):
+def _flush():
+    """Write out whatever _emit has buffered."""
+    if _OUT:
+        try:
+            sys.stdout.buffer.write(_OUT)
+            sys.stdout.buffer.flush()
+        finally:
+            _OUT.clear()
+
+atexit.register(_flush)
+
+def _emit_raw(buf):
+    """Queue bytes for stdout as they are; written in ~64 KiB chunks and at exit."""
+    _OUT.extend(buf)
+    if len(_OUT) >= 65536: _flush()
+
+def _emit(line):
+    """Queue one line (bytes) for stdout, newline added (see _emit_raw)."""
+    _OUT.extend(line)
+    _emit_raw(b"\n")
+
+def _bad_lines(buf):
+    """
+    Yield, in order, the offset where each line of buf (bytes or mmap)
+    that is not valid UTF-8 starts. buf is checked 1 MiB at a time with an
+    incremental decoder, so it is never decoded whole; after a bad byte the
+    check starts over on the next line.
     """
-    Given a list of text lines and a pattern, print each matching line.
-    If prefix is non-empty, print 'prefix+line'.
-    Returns True if at least one line matched.
+    dec = codecs.getincrementaldecoder("utf-8")()
+    i, n = 0, len(buf)
+    while i < n:
+        chunk = buf[i:i + (1 << 20)]
+        held = len(dec.getstate()[0])   # start of a character cut off by the last slice
+        try:
+            dec.decode(chunk, i + len(chunk) == n)
+            i += len(chunk)
+        except UnicodeDecodeError as e:
+            bad = i - held + e.start
+            yield buf.rfind(b"\n", 0, bad) + 1
+            i = buf.find(b"\n", bad) + 1
+            if not i: return
+            dec.reset()
+
+def _scan(buf, pat, prefix=b"", emit=None):
     """
+    Print (or hand to emit) the matching lines of a whole buffer (bytes or mmap), split on
+    b"\n". With a literal prefilter, find() jumps straight to the next line
+    that contains it, so a buffer without it costs one search. Lines that
+    are not valid UTF-8 skip the prefilter: search() drops their bad
+    bytes, which can join a literal.
+    Returns True if any line matched.
+    """
+    emit = emit or _emit
     matched = False
-    for line in lines:
-        if matches(line, pat):
-            _emit((prefix + line) if prefix else line)
+    lit = pat.literal
+    pos, n = 0, len(buf)
+    hit = -1
+    if lit:
+        bad = _bad_lines(buf)
+        nbad = next(bad, n)
+    while pos < n:
+        if lit:
+            if hit < pos:
+                hit = buf.find(lit, pos)
+                if hit < 0: hit = n
+            while nbad < pos: nbad = next(bad, n)
+            nxt = min(hit, nbad)
+            if nxt == n: break
+            pos = max(pos, buf.rfind(b"\n", pos, nxt) + 1)
+        end = buf.find(b"\n", pos)
+        if end < 0: end = n
+        line = buf[pos:end]
+        if search(pat, line):
+            emit(prefix + line)
             matched = True
+        pos = end + 1
     return matched
 
-def _process_file(path, pat, prefix=""):
+def _process_file(path, pat, prefix="", emit=None):
     """
-    Open a file safely, read all lines, and feed them to _process_lines.
+    Map a file into memory and scan it line by line (see _scan).
     Returns True if any line matched. On any I/O error, returns False.
     """
     try:
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            lines = f.read().splitlines()
+        f = open(path, "rb")
     except Exception:
         return False
-    return _process_lines(lines, pat, prefix)
+    with f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):   # empty file, pipe, device, ...
+            try:
+                buf = f.read()
+            except Exception:
+                return False
+        try:
+            return _scan(buf, pat, os.fsencode(prefix), emit)
+        finally:
+            if isinstance(buf, mmap.mmap): buf.close()
+
+POOL_FILES = 64     # fewer files than this are not worth starting workers for
+
+_WORKER_PAT = None
+
+def _init_worker(source):
+    """ProcessPoolExecutor initializer: compile the pattern once per worker."""
+    global _WORKER_PAT
+    _WORKER_PAT = _compile(source)
+
+def _scan_file(item):
+    """Worker side of _walk_dir: (path, shown) -> (matched, output bytes)."""
+    full, shown = item
+    out = []
+    hit = _process_file(full, _WORKER_PAT, f"{shown}:", out.append)
+    return hit, b"".join(line + b"\n" for line in out)
+
+def _walk(base_dir):
+    """
+    List the files under base_dir in os.walk order (a directory's files,
+    then its subdirectories depth-first), without following symlinked
+    directories. Returns parallel lists: DirEntry objects and the path to
+    print for each, which is built up name by name as the walk descends
+    instead of being normalized per file.
+    """
+    ents, shown = [], []
+    top = os.path.normpath(base_dir)
+    top = "" if top == "." else top if top.endswith(os.sep) else top + os.sep
+    stack = [(base_dir, top)]
+    while stack:
+        path, disp = stack.pop()
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        subdirs = []
+        for e in entries:
+            try:
+                is_dir = e.is_dir()
+            except OSError:
+                is_dir = False
+            if not is_dir:
+                ents.append(e); shown.append(disp + e.name)
+            elif not e.is_symlink():
+                subdirs.append((e.path, disp + e.name + os.sep))
+        stack.extend(reversed(subdirs))
+    return ents, shown
+
+def _size(entry):
+    """File size of a DirEntry, 0 if it cannot be stat'ed."""
+    try:
+        return entry.stat().st_size
+    except OSError:
+        return 0
 
 def _walk_dir(base_dir, pat):
     """
     Recursively walk a directory tree.
     For each file, print 'normalized_path:line' on matches.
+    Big trees are scanned by a process pool, biggest files first so the
+    long jobs do not end up last; output still keeps the walk order.
     Returns True if at least one line in the whole tree matched.
     """
+    ents, shown = _walk(base_dir)
+
+    ex = None
+    if len(ents) >= POOL_FILES and (os.cpu_count() or 1) > 1:
+        try:
+            ex = ProcessPoolExecutor(initializer=_init_worker, initargs=(pat.source,))
+        except (OSError, ImportError, NotImplementedError):
+            pass    # no working multiprocessing here; scan serially
+
     any_match = False
-    base_norm = os.path.normpath(base_dir)
-    for root, _, files in os.walk(base_dir):
-        for name in files:
-            full = os.path.join(root, name)
-            rel  = os.path.relpath(full, start=base_dir)
-            shown = os.path.normpath(os.path.join(base_norm, rel))
-            if _process_file(full, pat, prefix=f"{shown}:"):
-                any_match = True
+    if ex is None:
+        for e, disp in zip(ents, shown):
+            any_match |= _process_file(e.path, pat, f"{disp}:")
+        return any_match
+    order = sorted(range(len(ents)), key=lambda i: _size(ents[i]), reverse=True)
+    jobs = [(ents[i].path, shown[i]) for i in order]
+    done, nxt = [None] * len(ents), 0
+    with ex:
+        for i, res in zip(order, ex.map(_scan_file, jobs, chunksize=8)):
+            done[i] = res
+            # print every file whose turn in walk order has come
+            while nxt < len(done) and done[nxt] is not None:
+                hit, out = done[nxt]
+                done[nxt] = ()
+                nxt += 1
+                any_match |= hit
+                if out: _emit_raw(out)
     return any_match
 
 def main():
@@ -357,7 +1214,8 @@ def main():
       - If -r is set, treat each path as file or directory and walk directories.
       - If no -r and paths are given, scan those files.
       - If no paths, read from stdin.
-      - Exit 0 if any match printed. Exit 1 otherwise. Exit 1 on bad args.
+      - Exit 0 if any match printed. Exit 1 otherwise. Exit 1 on bad args
+        or a pattern nested too deeply to compile.
     """
     args = sys.argv[1:]
     if not args:
@@ -383,6 +1241,10 @@ def main():
 
     if pat is None:
         sys.exit(1)
+    try:
+        pat = _compile(pat)
+    except (ValueError, RecursionError):
+        sys.exit(1)
 
     if recurse:
         if not paths: sys.exit(1)
@@ -403,8 +1265,7 @@ def main():
         sys.exit(0 if any_match else 1)
 
     # No paths -> read from stdin as a single virtual file
-    txt = sys.stdin.read()
-    ok = _process_lines(txt.splitlines(), pat)
+    ok = _scan(sys.stdin.buffer.read(), pat)
     sys.exit(0 if ok else 1)
 
 if __name__ == "__main__":
@@ -0,0 +1,236 @@
+import multiprocessing, os, random, re, subprocess, sys
+
+import pytest
+
+from tinygrep import cli
+
+CLI = os.path.join(os.path.dirname(__file__), os.pardir, "src", "tinygrep", "cli.py")
+
+def run(args, data=b"", cwd=None):
+    """Run the CLI as a script; return (exit code, stdout bytes)."""
+    r = subprocess.run([sys.executable, CLI] + args, input=data, cwd=cwd,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return r.returncode, r.stdout
+
+@pytest.fixture(params=["own", "hyperscan"])
+def engine(request, monkeypatch):
+    """Run a test with tinygrep's own engine and, if installed, Hyperscan on every line."""
+    if request.param == "own":
+        monkeypatch.setattr(cli, "hyperscan", None)
+    elif cli.hyperscan is None:
+        pytest.skip("hyperscan not installed")
+    else:
+        monkeypatch.setattr(cli, "HS_MIN_LEN", 0)
+    cli._compile.cache_clear()
+    yield request.param
+    cli._compile.cache_clear()
+
+# ---------------- README examples ----------------
+
+@pytest.mark.parametrize("pattern, line", [
+    (r"('(cat) and \2') is the same as \1", "'cat and cat' is the same as 'cat and cat'"),
+    (r"((\w\w\w\w) (\d\d\d)) is doing \2 \3 times, and again \1 times",
+     "grep 101 is doing grep 101 times, and again grep 101 times"),
+    (r"(c.t|d.g) and (f..h|b..d), \1 with \2", "cat and fish, cat with fish"),
+    (r"(how+dy) (he?y) there", "howwdy hey there"),
+    (r"c.t", "cat"),
+    (r"orange$", "strawberry_orange"),
+    (r"^pear$", "pear"),
+    (r"\d apple", "sally has 3 apples"),
+    (r"([abc]+)-([def]+) is \1-\2, not [^xyz]+", "abc-def is abc-def, not efg"),
+    (r"ana$", "banana"),
+    (r"(cat) and \1", "cat and cat"),
+])
+def test_readme_examples(pattern, line):
+    assert run(["-E", pattern], line.encode()) == (0, line.encode() + b"\n")
+
+def test_readme_recursive(tmp_path):
+    (tmp_path / "dir" / "subdir").mkdir(parents=True)
+    (tmp_path / "dir" / "fruits-8790.txt").write_text("orange\npear\n")
+    (tmp_path / "dir" / "subdir" / "vegetables-9209.txt").write_text("cabbage\ncelery\ncauliflower\n")
+    (tmp_path / "dir" / "vegetables-7316.txt").write_text("corn\nspinach\ncucumber\n")
+    rc, out = run(["-r", "-E", ".+er", "dir/"], cwd=tmp_path)
+    assert rc == 0
+    assert sorted(out.splitlines()) == [b"dir/subdir/vegetables-9209.txt:cauliflower",
+                                        b"dir/subdir/vegetables-9209.txt:celery",
+                                        b"dir/vegetables-7316.txt:cucumber"]
+
+def test_readme_multiple_files(tmp_path):
+    (tmp_path / "fruits-9153.txt").write_text("orange\nlemon\n")
+    (tmp_path / "vegetables-4914.txt").write_text("zucchini\nspinach\n")
+    rc, out = run(["-E", "or.+$", "fruits-9153.txt", "vegetables-4914.txt"], cwd=tmp_path)
+    assert (rc, out) == (0, b"fruits-9153.txt:orange\n")
+
+def test_no_match_exit_code():
+    assert run(["-E", "x"], b"abc\n") == (1, b"")
+
+def test_deep_nesting(engine):
+    assert cli.matches("xay", "(" * 400 + "a" + ")" * 400)
+    assert run(["-E", "(" * 5000 + "a" + ")" * 5000], b"a\n") == (1, b"")
+
+# ---------------- UTF-8 ----------------
+
+@pytest.mark.parametrize("pattern, line, hit", [
+    ("[é]", "voilà", False),
+    ("[é]", "©", False),
+    ("[é]", "café", True),
+    ("c.t", "cét", True),
+    ("^.$", "é", True),
+    ("^.$", "😀", True),
+    ("^..$", "é", False),
+    ("na[^x]ve", "naïve", True),
+    ("^[^a]$", "€", True),
+    ("[à-é]", "è", True),
+    ("[à-é]", "ß", False),
+    (r"^(.)\1$", "éé", True),
+    (r"^(.)\1$", "éè", False),
+])
+def test_utf8_characters(engine, pattern, line, hit):
+    assert cli.matches(line, pattern) == hit
+
+def test_invalid_utf8_is_skipped_but_printed():
+    assert run(["-E", "^ab$"], b"a\xffb\n") == (0, b"a\xffb\n")
+    assert run(["-E", "ab"], b"a\xffb\n") == (0, b"a\xffb\n")
+
+def test_invalid_utf8_only_affects_its_own_line(tmp_path):
+    (tmp_path / "f.txt").write_bytes(b"ab\nx\xffy\na\xc3b\nab\n" + b"cd\n" * 100000 + b"a\xffb\n")
+    rc, out = run(["-E", "ab", "f.txt"], cwd=tmp_path)
+    assert (rc, out) == (0, b"ab\na\xc3b\nab\na\xffb\n")
+
+def test_groups_numbered_per_alternative(engine):
+    assert cli.matches("cc", r"(a)b|(c)\1")
+    assert cli.matches("ab", r"(a)b|(c)\1")
+    assert not cli.matches("ca", r"(a)b|(c)\1")
+
+# ---------------- differential fuzz against Python's re ----------------
+#
+# Random patterns are written twice, once for tinygrep and once for re,
+# and must agree on random lines. Each top-level alternative numbers its
+# own groups, so re gets one compiled pattern per alternative.
+
+ALPH = "abcé€"
+CLASSES = [("[ab]", "[ab]"), ("[^a]", "[^a]"), ("[bé]", "[bé]"), ("[^]", r"[\s\S]"),
+           ("[a-c]", "[a-c]"), ("[^b-c]", "[^b-c]"), ("[^é]", "[^é]"),
+           ("[à-€]", "[à-€]"), ("[^a-é]", "[^a-é]"), ("[é😀]", "[é😀]")]
+
+def gen_item(d, ngroups, backrefs):
+    r = random.random()
+    if r < 0.35:
+        c = random.choice(ALPH); return c, re.escape(c)
+    if r < 0.45: return ".", "."
+    if r < 0.55: return random.choice(CLASSES)
+    if r < 0.6: return "\\d", "[0-9]"
+    if r < 0.63: return "\\w", "[0-9A-Za-z_]"
+    if r < 0.66: return "*", r"\*"
+    if r < 0.72 and backrefs and ngroups[0]:
+        g = random.randint(1, ngroups[0]); return "\\%d" % g, "(?:\\%d)" % g
+    if d < 2:
+        ngroups[0] += 1
+        alts = [gen_seq(d + 1, ngroups, backrefs) for _ in range(random.randint(1, 3))]
+        return "(" + "|".join(a for a, _ in alts) + ")", "(" + "|".join(b for _, b in alts) + ")"
+    c = random.choice(ALPH); return c, c
+
+def gen_seq(d, ngroups, backrefs):
+    ours, py = "", ""
+    for _ in range(random.randint(0, 3)):
+        a, b = gen_item(d, ngroups, backrefs)
+        q = random.choice(["", "", "+", "?"])
+        ours += a + q; py += "(?:" + b + ")" + q
+    return ours, py
+
+def gen_pattern(backrefs=True):
+    """(tinygrep pattern, list of re patterns, one per top-level alternative)"""
+    alts = []
+    for _ in range(random.choice([1, 1, 1, 2, 3])):
+        a, b = gen_seq(0, [0], backrefs)
+        if random.random() < 0.25: a, b = "^" + a, "^" + b
+        if random.random() < 0.25: a, b = a + "$", b + r"\Z"
+        alts.append((a, b))
+    return "|".join(a for a, _ in alts), [b for _, b in alts]
+
+def gen_line():
+    return "".join(random.choice("aabbc1_*éè€😀") for _ in range(random.randint(0, 10)))
+
+def oracle(py, lines):
+    """re's answers for lines, or None if it rejects the pattern."""
+    try:
+        rxs = [re.compile(b) for b in py]
+    except re.error:
+        return None
+    return [any(rx.search(line) for rx in rxs) for line in lines]
+
+@pytest.mark.parametrize("backrefs", [True, False])
+def test_fuzz_against_re(engine, backrefs):
+    # re backtracks exponentially on some nested patterns; it runs in a
+    # worker, and patterns it cannot answer in time are skipped
+    random.seed(1)
+    pool = multiprocessing.Pool(1)
+    try:
+        for _ in range(800):
+            ours, py = gen_pattern(backrefs)
+            lines = [gen_line() for _ in range(8)]
+            try:
+                want = pool.apply_async(oracle, (py, lines)).get(timeout=2)
+            except multiprocessing.TimeoutError:
+                pool.terminate(); pool = multiprocessing.Pool(1)
+                continue
+            if want is None: continue
+            for line, hit in zip(lines, want):
+                assert cli.matches(line, ours) == hit, (ours, py, line)
+    finally:
+        pool.terminate()
+
+def test_fuzz_dots(engine):
+    """'.'s around a literal (the "dots" plan), including lines with '\\n'."""
+    random.seed(2)
+    for _ in range(1500):
+        side = lambda: "".join(random.choice([".", ".+", ".?"]) for _ in range(random.randint(0, 2)))
+        p = side() + "".join(random.choice("ab") for _ in range(random.randint(1, 3))) + side()
+        if random.random() < .4: p = "^" + p
+        if random.random() < .4: p = p + "$"
+        if random.random() < .2: p = p + "|" + random.choice(["c", "^c.+", "b.a$"])
+        rx = re.compile(p.replace("$", r"\Z"))
+        for _ in range(6):
+            line = "".join(random.choice("aabbc\n") for _ in range(random.randint(0, 8)))
+            assert cli.matches(line, p) == (rx.search(line) is not None), (p, line)
+
+def test_vm_agrees_with_nfa():
+    """Backref-free patterns forced through the VM give the NFA's answers."""
+    random.seed(3)
+    for _ in range(800):
+        p, _ = gen_pattern(backrefs=False)
+        alts = cli.split_alts(p)
+        progs = [cli.compile_program(a, True) for a in alts]
+        nfa = cli.compile_nfa(p, True)
+        for _ in range(6):
+            line = gen_line().encode()
+            assert any(cli.vm_search(line, prog) for prog in progs) == cli.nfa_search(line, nfa), (p, line)
+
+def test_to_pcre_agrees():
+    """The Hyperscan translation, checked with re on the same bytes."""
+    random.seed(4)
+    for _ in range(800):
+        p, _ = gen_pattern(backrefs=False)
+        rx = re.compile(cli.to_pcre(p, True).replace(rb"\z", rb"\Z"))
+        for _ in range(6):
+            line = gen_line()
+            assert (rx.search(line.encode()) is not None) == cli.matches(line, p), (p, line)
+
+# ---------------- -r with a process pool ----------------
+
+def test_pool_output_matches_serial(tmp_path, monkeypatch, capsysbinary):
+    for i in range(40):
+        d = tmp_path / ("d%d" % (i % 3))
+        d.mkdir(exist_ok=True)
+        (d / ("f%d.txt" % i)).write_bytes(b"".join(b"%d h\xc3\xa9llo\n" % j for j in range(i * 20)))
+    pat = cli._compile("1.+7 h.llo")
+    monkeypatch.setattr(cli, "POOL_FILES", 10**9)
+    assert cli._walk_dir(str(tmp_path), pat)
+    cli._flush()
+    serial = capsysbinary.readouterr().out
+    monkeypatch.setattr(cli, "POOL_FILES", 1)
+    monkeypatch.setattr(os, "cpu_count", lambda: 2)
+    assert cli._walk_dir(str(tmp_path), pat)
+    cli._flush()
+    assert capsysbinary.readouterr().out == serial
+    assert serial.count(b"\n") > 100